@@ -28,12 +28,10 @@ Date(yyyy-mm-dd)    Author              Comments
 # Import Python packages
 import streamlit as st
 import plotly.express as px
-import json
 
 # Import Snowflake modules
 from snowflake.snowpark import Session
 import snowflake.snowpark.functions as F
-from snowflake.snowpark import Window
 
 # Set Streamlit page config
 st.set_page_config(
@@ -50,12 +48,11 @@ st.subheader("Data-driven recommendations for food truck drivers.")
 # Refresh Snowflake session after 60 minutes
 @st.cache_resource(ttl=3600)
 def init_connection():
-    # Get account credentials from a json file
-    with open("data_scientist_auth.json") as f:
-        data = json.load(f)
-        username = data["username"]
-        password = data["password"]
-        account = data["account"]
+    # Get account credentials from the [snowflake] section of .streamlit/secrets.toml
+    credentials = st.secrets["snowflake"]
+    username = credentials["username"]
+    password = credentials["password"]
+    account = credentials["account"]
 
     # Specify connection parameters
     connection_parameters = {
@@ -75,58 +72,77 @@ def init_connection():
 # Connect to Snowflake
 session = init_connection()
 
+
+# Get the list of cities, refreshed after 60 minutes
+@st.cache_data(ttl=3600)
+def get_cities(_session):
+    return (
+        _session.table("frostbyte_tasty_bytes_dev.analytics.shift_sales_v")
+        .select("city")
+        .distinct()
+        .sort("city")
+        .to_pandas()["CITY"]
+        .tolist()
+    )
+
+
 # Create input widgets for cities and shift
 with st.container():
     col1, col2 = st.columns(2)
     with col1:
         # Drop down to select city
-        city = st.selectbox(
-            "City:",
-            session.table("frostbyte_tasty_bytes_dev.analytics.shift_sales_v")
-            .select("city")
-            .distinct()
-            .sort("city"),
-        )
+        city = st.selectbox("City:", get_cities(session))
 
     with col2:
         # Select AM/PM Shift
         shift = st.radio("Shift:", ("AM", "PM"), horizontal=True)
 
 
-# Get predictions for city and shift time
+# Get predictions for city and shift time, refreshed after 60 minutes
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
 def get_predictions(city, shift):
     # Get data and filter by city and shift
     snowpark_df = session.table(
         "frostbyte_tasty_bytes_dev.analytics.shift_sales_v"
     ).filter((F.col("shift") == shift) & (F.col("city") == city))
 
-    # Get rolling average
-    window_by_location_all_days = (
-        Window.partition_by("location_id")
-        .order_by("date")
-        .rows_between(Window.UNBOUNDED_PRECEDING, Window.CURRENT_ROW - 1)
-    )
-
-    snowpark_df = snowpark_df.with_column(
-        "avg_location_shift_sales",
-        F.avg("shift_sales").over(window_by_location_all_days),
+    # Keep only the columns needed downstream and materialize them once, since
+    # the filtered rows are read several times below
+    snowpark_df = snowpark_df.select(
+        "location_id",
+        "date",
+        "shift_sales",
+        "month",
+        "day_of_week",
+        "latitude",
+        "longitude",
+        "city_population",
     ).cache_result()
 
-    # Get tomorrow's date
-    date_tomorrow = (
-        snowpark_df.filter(F.col("shift_sales").is_null())
-        .select(F.min("date"))
-        .collect()[0][0]
+    # Get tomorrow's date, kept in Snowflake to avoid an extra round trip
+    date_tomorrow_df = snowpark_df.filter(F.col("shift_sales").is_null()).select(
+        F.min("date").alias("date_tomorrow")
     )
 
-    # Filter to tomorrow's date
-    snowpark_df = snowpark_df.filter(F.col("date") == date_tomorrow)
+    # Get average shift sales by location over all dates before tomorrow
+    # (each location belongs to a single city, so filtering by city keeps every
+    # location's full history)
+    history_df = (
+        snowpark_df.join(date_tomorrow_df, F.col("date") < F.col("date_tomorrow"))
+        .group_by("location_id")
+        .agg(F.avg("shift_sales").alias("avg_location_shift_sales"))
+    )
+
+    # Filter to tomorrow's date and add the average
+    snowpark_df = snowpark_df.join(
+        date_tomorrow_df, F.col("date") == F.col("date_tomorrow")
+    ).join(history_df, "location_id", "left")
 
     # Impute
     snowpark_df = snowpark_df.fillna(value=0, subset=["avg_location_shift_sales"])
 
-    # Encode
-    snowpark_df = snowpark_df.with_column("shift", F.iff(F.col("shift") == "AM", 1, 0))
+    # Encode (shift is constant after filtering, so encode it once as a literal)
+    snowpark_df = snowpark_df.with_column("shift", F.lit(1 if shift == "AM" else 0))
 
     # Define feature columns
     feature_cols = [
@@ -139,28 +155,35 @@ def get_predictions(city, shift):
         "SHIFT",
     ]
 
-    # Call the inference user-defined function
+    # Call the inference user-defined function, clipping negative predictions to 0
     snowpark_df = snowpark_df.select(
         "location_id",
         "latitude",
         "longitude",
-        "avg_location_shift_sales",
-        F.call_udf(
-            "udf_linreg_predict_location_sales", [F.col(c) for c in feature_cols]
+        F.greatest(
+            F.lit(0.0),
+            F.call_udf(
+                "udf_linreg_predict_location_sales", [F.col(c) for c in feature_cols]
+            ),
         ).alias("predicted_shift_sales"),
     )
 
-    return snowpark_df.to_pandas()
+    predictions = snowpark_df.to_pandas()
+
+    # Get the map center
+    center_lat = predictions["LATITUDE"].to_numpy().mean()
+    center_lon = predictions["LONGITUDE"].to_numpy().mean()
+
+    return predictions, center_lat, center_lon
 
 
 # Update predictions and plot when the "Update" button is clicked
 if st.button("Update"):
     # Get predictions
     with st.spinner("Getting predictions..."):
-        predictions = get_predictions(city, shift)
+        predictions, center_lat, center_lon = get_predictions(city, shift)
 
     # Plot on a map
-    predictions["PREDICTED_SHIFT_SALES"].clip(0, inplace=True)
     fig = px.scatter_mapbox(
         predictions,
         lat="LATITUDE",
@@ -168,6 +191,7 @@ if st.button("Update"):
         hover_name="LOCATION_ID",
         size="PREDICTED_SHIFT_SALES",
         color="PREDICTED_SHIFT_SALES",
+        center={"lat": center_lat, "lon": center_lon},
         zoom=8,
         height=800,
         width=1000,